@@ -1,7 +1,11 @@
 import subprocess
 import sys
 import os
+import mmap
+import re
+import shutil
 import tkinter as tk
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from tkinter import filedialog, messagebox
 
 # Check for the mutagen module and prompt user for installation.
@@ -29,6 +33,16 @@ except ImportError:
 
 # Static settings
 input_file_encoding = "cp1252"  # Default encoding for CUE files.
+DEBUG = False  # Print full frame dumps while embedding chapters.
+
+# Matches TRACK lines, quoted TITLEs and INDEX 01 lines in one pass. Lines
+# start after CR or LF, so CRLF, LF and CR-only sheets all work. An INDEX 01
+# line without a valid MM:SS:FF time still matches (group 2 only) so it can
+# be reported.
+_CUE_RE = re.compile(
+    rb'(?i)(?<![^\r\n])[ \t]*(?:TRACK\b|TITLE[^"\r\n]*"([^"\r\n]*)'
+    rb'|(INDEX[ \t]+01)\b(?:[ \t]+(\d+):(\d+):(\d+)[ \t]*(?![^\r\n])|[^\r\n]*))'
+)
 
 
 def parse_cue_file(cue_path):
@@ -36,77 +50,106 @@ def parse_cue_file(cue_path):
     Parses a CUE file (assumed to be encoded in 'input_file_encoding')
     and returns a list of (title, start_time_ms) tuples.
     """
+    with open(cue_path, "rb") as cue_file:
+        try:
+            mm = mmap.mmap(cue_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            # Empty files cannot be mapped, and some file systems (e.g. SMB/FUSE
+            # mounts) do not support mmap; read those the plain way.
+            return _parse_cue_data(cue_file.read())
+        # Scan the mapped bytes directly; only the title slices get decoded.
+        with mm:
+            return _parse_cue_data(mm)
+
+
+def _parse_cue_data(data):
+    """
+    Scans the raw bytes (or mmap) of a CUE file, see parse_cue_file().
+    A TITLE without a closing quote runs to the end of the line; INDEX 01
+    lines with an unreadable time are reported and otherwise ignored.
+    """
     chapters = []
     current_title = None
     current_time = None
-
-    with open(cue_path, "r", encoding=input_file_encoding) as f:
-        for line in f:
-            line = line.strip()
-            if line.upper().startswith("TRACK"):
-                if current_title is not None and current_time is not None:
-                    chapters.append((current_title, current_time))
-                current_title = None
-                current_time = None
-            elif line.upper().startswith("TITLE"):
-                if '"' in line:
-                    current_title = line.split('"')[1]
-            elif "INDEX 01" in line.upper():
-                try:
-                    parts = line.split()
-                    time_str = parts[-1]
-                    m, s, f = time_str.split(":")
-                    m = int(m)
-                    s = int(s)
-                    f = int(f)
-                    current_time = int((m * 60 + s + f / 75.0) * 1000)
-                except Exception as e:
-                    print("Error parsing time from line:", line, e)
-        if current_title is not None and current_time is not None:
-            chapters.append((current_title, current_time))
+    # Local bindings avoid attribute and global lookups in the match loop.
+    add_chapter = chapters.append
+    encoding = input_file_encoding
+
+    for match in _CUE_RE.finditer(data):
+        # lastindex tells which branch matched: None TRACK, 1 TITLE,
+        # 5 INDEX 01 with time, 2 INDEX 01 without a valid time.
+        kind = match.lastindex
+        if kind is None:
+            if current_title is not None and current_time is not None:
+                add_chapter((current_title, current_time))
+            current_title = None
+            current_time = None
+        elif kind == 1:
+            current_title = match.group(1).decode(encoding)
+        elif kind == 5:
+            m, s, f = match.group(3, 4, 5)
+            # CUE times are MM:SS:FF with 75 frames per second.
+            current_time = ((int(m) * 60 + int(s)) * 75 + int(f)) * 1000 // 75
+        else:
+            line = match.group(0).strip().decode(encoding, errors="replace")
+            print("Error parsing time from line:", line)
+    if current_title is not None and current_time is not None:
+        add_chapter((current_title, current_time))
     return chapters
 
+
+class _TagDoesNotFit(Exception):
+    """Raised by _in_place_padding when the new tag is larger than the old one."""
+
+
+def _in_place_padding(info):
+    """
+    Mutagen padding callback that keeps the tag size unchanged.
+    A negative padding means the audio data would have to be moved.
+    """
+    if info.padding < 0:
+        raise _TagDoesNotFit()
+    return info.padding
+
+
 def embed_chapters(mp3_path, chapters):
     """
     Embeds chapter markers into the MP3 as ID3 tags using Mutagen.
     Creates a CTOC frame and then one CHAP frame for each chapter.
-    Also creates a backup of the original file (if not already present).
+    Also creates a backup of the original file (if not already present)
+    when the new tag does not fit into the existing one.
     """
     try:
         tags = ID3(mp3_path)
     except ID3NoHeaderError:
         tags = ID3()
 
-    # Remove existing CHAP/CTOC frames to avoid conflicts.
-    for key in list(tags.keys()):
-        if key.startswith("CHAP") or key.startswith("CTOC"):
-            del tags[key]
+    # Remove existing CTOC frames to avoid conflicts (CHAP frames are
+    # replaced by setall below).
+    tags.delall("CTOC")
 
     mp3_info = MP3(mp3_path)
     total_duration_ms = int(mp3_info.info.length * 1000)
 
-    child_ids = []
-    for idx, (title, start_time) in enumerate(chapters):
-        element_id = f"chp{idx+1:02d}"  # Zero-padded (e.g., chp01, chp02)
-        child_ids.append(element_id)
+    # Zero-padded (e.g., chp01, chp02).
+    element_ids = [f"chp{i:02d}" for i in range(1, len(chapters) + 1)]
 
     ctoc = CTOC(
         element_id="toc",
         flags=CTOCFlags.TOP_LEVEL | CTOCFlags.ORDERED,
-        child_element_ids=child_ids,
+        child_element_ids=element_ids,
         sub_frames=[TIT2(encoding=3, text=["I'm a TOC"])]
     )
-    print(f"Added CTOC frame: {ctoc}")
+    if DEBUG:
+        print(f"Added CTOC frame: {ctoc}")
     tags.add(ctoc)
-    print(f"Tags after adding CTOC: {tags}")
-
-    for idx, (title, start_time) in enumerate(chapters):
-        element_id = f"chp{idx+1:02d}"
-        if idx < len(chapters) - 1:
-            end_time = chapters[idx+1][1]
-        else:
-            end_time = total_duration_ms
+    if DEBUG:
+        print(f"Tags after adding CTOC: {tags}")
 
+    # Each chapter ends where the next one starts; the last ends with the file.
+    next_chapters = chapters[1:] + [(None, total_duration_ms)]
+    chaps = []
+    for element_id, (title, start_time), (_, end_time) in zip(element_ids, chapters, next_chapters):
         chap = CHAP(
             element_id=element_id,
             start_time=start_time,
@@ -115,35 +158,59 @@ def embed_chapters(mp3_path, chapters):
             end_offset=0,
             sub_frames=[TIT2(encoding=3, text=title)]
         )
-        tags.add(chap)
-        print(f"Added CHAP frame: {chap}")
+        chaps.append(chap)
+        if DEBUG:
+            print(f"Added CHAP frame: {chap}")
+    # The frames are freshly built, so skip add()'s per-frame upgrade and merge
+    # checks and replace all CHAP frames in one call.
+    tags.setall("CHAP", chaps)
 
-    # Create backup before saving.
     backup_file = mp3_path + ".bak"
-    if not os.path.exists(backup_file):
-        try:
-            with open(mp3_path, "rb") as orig, open(backup_file, "wb") as bak:
-                bak.write(orig.read())
-            print(f"Backup created: {backup_file}")
-        except Exception as e:
-            print("Error creating backup:", e)
 
-    # Try to save the modified tags.
+    # First try to save in place. If the new tag fits into the old one, Mutagen
+    # only overwrites the tag area and the audio data is never moved, so no
+    # full-file backup is needed.
     try:
-        tags.save(mp3_path, v2_version=4)
-        print("Chapters successfully embedded into the MP3 file.")
+        tags.save(mp3_path, v2_version=4, padding=_in_place_padding)
+        tag_fits = True
+    except _TagDoesNotFit:
+        tag_fits = False
     except Exception as save_err:
-        print("Error saving ID3 tags:", save_err)
-        # Restore backup to revert modifications.
+        print(f"Error saving ID3 tags to {mp3_path}: {save_err}")
+        raise
+
+    if not tag_fits:
+        # The tag grows, so Mutagen has to shift the whole audio stream.
+        # Create backup before saving.
+        if not os.path.exists(backup_file):
+            try:
+                # copy2 uses the OS fast-copy path (sendfile/CopyFileEx) and keeps the
+                # file's mode, timestamps and xattrs, so a restore via os.replace gives
+                # back the original file. A hardlink is not an option: Mutagen rewrites
+                # the MP3 in place, which would change the backup along with it.
+                shutil.copy2(mp3_path, backup_file)
+                print(f"Backup created: {backup_file}")
+            except Exception as e:
+                print("Error creating backup:", e)
+
+        # Try to save the modified tags.
         try:
-            with open(backup_file, "rb") as bak, open(mp3_path, "wb") as orig:
-                orig.write(bak.read())
-            print("Original file restored from backup due to save error.")
-        except Exception as resex:
-            print("Error restoring backup:", resex)
-        raise save_err  # Re-raise to indicate processing failure.
-    
-    print(f"Final tags: {tags}")
+            # Keep Mutagen's default padding for a growing tag (which scales with the
+            # file size), but never less than 4 KiB, so later runs usually fit and
+            # take the in-place path above without any backup.
+            tags.save(mp3_path, v2_version=4,
+                      padding=lambda info: max(4096, info.get_default_padding()))
+        except Exception as save_err:
+            print(f"Error saving ID3 tags to {mp3_path}: {save_err}")
+            # Restore backup to revert modifications.
+            try:
+                os.replace(backup_file, mp3_path)
+                print("Original file restored from backup due to save error.")
+            except Exception as resex:
+                print("Error restoring backup:", resex)
+            raise save_err  # Re-raise to indicate processing failure.
+
+    print(f"{len(chapters)} chapters successfully embedded into {mp3_path}.")
     return backup_file  # Return the backup file name for further processing.
 
 
@@ -155,31 +222,68 @@ def process_files(cue_path, mp3_path):
         chapters = parse_cue_file(cue_path)
         if not chapters:
             raise ValueError("No chapters found in the CUE file.")
-        print(f"Found {len(chapters)} chapters in the CUE file.")
+        print(f"Found {len(chapters)} chapters in {cue_path}.")
         embed_chapters(mp3_path, chapters)
         return True
     except Exception as e:
-        print("Error during processing:", e)
+        print(f"Error processing {mp3_path}: {e}")
         return False
 
 
+def scan_mp3_cue_pairs(folder_path):
+    """
+    Scans a single folder (non-recursively) and returns a sorted list of
+    (mp3_path, cue_path) pairs plus a sorted list of MP3s without a CUE file.
+    """
+    mp3s = []
+    cues = set()
+    with os.scandir(folder_path) as it:
+        for entry in it:
+            name = entry.name
+            lower = name.lower()
+            if lower.endswith(".mp3"):
+                if entry.is_file():
+                    mp3s.append(name)
+            elif lower.endswith(".mp3.cue"):
+                if entry.is_file():
+                    cues.add(name)
+    pairs = []
+    unpaired = []
+    for name in sorted(mp3s):
+        mp3_full = os.path.join(folder_path, name)
+        cue_full = mp3_full + ".cue"
+        # Exact names pair without a stat. Only the rest are checked with
+        # os.path.exists, so case-insensitive file systems (NTFS, vfat, SMB,...)
+        # still find e.g. 'book.MP3.cue' for 'Book.mp3'.
+        if name + ".cue" in cues or os.path.exists(cue_full):
+            pairs.append((mp3_full, cue_full))
+        else:
+            unpaired.append(mp3_full)
+    return pairs, unpaired
+
+
 def process_folder(folder_path):
     """
     Processes all MP3 files in a folder (each with a corresponding .cue file).
     """
-    processed_any = False
-    for filename in os.listdir(folder_path):
-        if filename.lower().endswith(".mp3"):
-            mp3_full = os.path.join(folder_path, filename)
-            cue_full = mp3_full + ".cue"
-            if os.path.exists(cue_full):
-                print(f"Processing:\n  MP3: {mp3_full}\n  CUE: {cue_full}")
-                process_files(cue_full, mp3_full)
-                processed_any = True
-            else:
-                print(f"Warning: No CUE file for {mp3_full}")
-    if not processed_any:
+    if not os.path.isdir(folder_path):
+        print(f"Folder not found: {folder_path}")
+        return
+    pairs, unpaired = scan_mp3_cue_pairs(folder_path)
+    for mp3_full in unpaired:
+        print(f"Warning: No CUE file for {mp3_full}")
+    if not pairs:
         print("No suitable MP3/CUE pairs found in folder.")
+        return
+    # Same pool as the GUI; afterwards clean up like process_files does.
+    files_to_delete = process_folder_with_deletion(
+        pairs, progress=lambda done, total: print(f"[{done}/{total}] pairs processed"))
+    for f in files_to_delete:
+        try:
+            os.remove(f)
+            print(f"File '{f}' deleted.")
+        except Exception as e:
+            print(f"Error deleting {f}: {e}")
 
 
 class MainWindow(tk.Tk):
@@ -229,13 +333,24 @@ class MainWindow(tk.Tk):
         self.btn_cue = tk.Button(self, text="Browse...", command=self.browse_cue)
         self.btn_cue.grid(row=2, column=2, padx=10, pady=10)
 
+        # Folder Mode widgets are built on first use, see _build_folder_widgets().
+
+        # Start button.
+        self.btn_start = tk.Button(self, text="Start Processing", width=20, command=self.start_processing)
+        self.btn_start.grid(row=4, column=1, pady=20)
+
+
+    def _build_folder_widgets(self):
+        """
+        Creates the Folder Mode widgets the first time Folder Mode is selected.
+        """
         # Widgets for Folder Mode.
         self.label_folder = tk.Label(self, text="Folder:")
         self.entry_folder = tk.Entry(self, width=50)
         self.btn_folder = tk.Button(self, text="Browse...", command=self.browse_folder)
         self.recursive_var = tk.BooleanVar(value=False)
         self.chk_recursive = tk.Checkbutton(self, text="Recursive (include subfolders)", variable=self.recursive_var)
-        # Place them in a row (row 3) but hide initially.
+        # Place them in a row (row 3).
         self.label_folder.grid(row=3, column=0, padx=10, pady=10, sticky="e")
         self.entry_folder.grid(row=3, column=1, padx=10, pady=10)
         self.btn_folder.grid(row=3, column=2, padx=10, pady=10)
@@ -244,15 +359,6 @@ class MainWindow(tk.Tk):
         import os
         default_dir = os.path.dirname(os.path.abspath(__file__))
         self.entry_folder.insert(0, default_dir)
-        self.label_folder.grid_remove()
-        self.entry_folder.grid_remove()
-        self.btn_folder.grid_remove()
-        self.chk_recursive.grid_remove()
-
-        # Start button.
-        self.btn_start = tk.Button(self, text="Start Processing", width=20, command=self.start_processing)
-        self.btn_start.grid(row=4, column=1, pady=20)
-
 
     def update_mode(self):
         """
@@ -267,11 +373,12 @@ class MainWindow(tk.Tk):
             self.label_cue.grid()
             self.entry_cue.grid()
             self.btn_cue.grid()
-            # Hide folder mode widgets.
-            self.label_folder.grid_remove()
-            self.entry_folder.grid_remove()
-            self.btn_folder.grid_remove()
-            self.chk_recursive.grid_remove()
+            # Hide folder mode widgets (if they were built yet).
+            if hasattr(self, "label_folder"):
+                self.label_folder.grid_remove()
+                self.entry_folder.grid_remove()
+                self.btn_folder.grid_remove()
+                self.chk_recursive.grid_remove()
         else:
             # Hide single mode widgets.
             self.label_mp3.grid_remove()
@@ -280,7 +387,10 @@ class MainWindow(tk.Tk):
             self.label_cue.grid_remove()
             self.entry_cue.grid_remove()
             self.btn_cue.grid_remove()
-            # Show folder mode widgets.
+            # Show folder mode widgets, building them on first use.
+            if not hasattr(self, "label_folder"):
+                self._build_folder_widgets()
+                return
             self.label_folder.grid()
             self.entry_folder.grid()
             self.btn_folder.grid()
@@ -344,7 +454,10 @@ class MainWindow(tk.Tk):
             if not messagebox.askokcancel("Confirm Files to Process", preview):
                 return
             # Process and collect files to delete
-            files_to_delete = process_folder_with_deletion(pairs)
+            try:
+                files_to_delete = process_folder_with_deletion(pairs, progress=self.show_progress)
+            finally:
+                self.btn_start.config(text="Start Processing")
             if files_to_delete:
                 delist = "The following files are ready to be deleted after processing:\n\n" + "\n".join(files_to_delete)
                 if messagebox.askyesno("Delete Files?", delist + "\n\nDo you want to delete these files?"):
@@ -355,6 +468,10 @@ class MainWindow(tk.Tk):
                             print(f"Error deleting {f}: {e}")
             messagebox.showinfo("Done", "Processing of folder complete.")
 
+    def show_progress(self, done, total):
+        self.btn_start.config(text=f"Processing {done}/{total}...")
+        self.update_idletasks()
+
     def collect_mp3_cue_pairs(self, folder_path, recursive):
         pairs = []
         if recursive:
@@ -365,13 +482,8 @@ class MainWindow(tk.Tk):
                         cue_full = mp3_full + ".cue"
                         if os.path.exists(cue_full):
                             pairs.append((mp3_full, cue_full))
-        else:
-            for filename in os.listdir(folder_path):
-                if filename.lower().endswith(".mp3"):
-                    mp3_full = os.path.join(folder_path, filename)
-                    cue_full = mp3_full + ".cue"
-                    if os.path.exists(cue_full):
-                        pairs.append((mp3_full, cue_full))
+        elif os.path.isdir(folder_path):
+            pairs, _ = scan_mp3_cue_pairs(folder_path)
         return pairs
 
 def process_files(cue_path, mp3_path):
@@ -383,7 +495,7 @@ def process_files(cue_path, mp3_path):
         chapters = parse_cue_file(cue_path)
         if not chapters:
             raise ValueError("No chapters found in the CUE file.")
-        print(f"Found {len(chapters)} chapters in the CUE file.")
+        print(f"Found {len(chapters)} chapters in {cue_path}.")
         backup_file = embed_chapters(mp3_path, chapters)
         
         # If everything was processed successfully, delete the backup and cue file.
@@ -395,29 +507,59 @@ def process_files(cue_path, mp3_path):
             print(f"CUE file '{cue_path}' deleted.")
         return True
     except Exception as e:
-        print("Error during processing:", e)
+        print(f"Error processing {mp3_path}: {e}")
         return False
 
+
+def embed_pair(mp3_full, cue_full):
+    """
+    Embeds the chapters of one MP3/CUE pair (folder mode worker).
+    Returns the backup and CUE files that may be deleted afterwards.
+    """
+    print(f"Processing:\n  MP3: {mp3_full}\n  CUE: {cue_full}")
+    files_to_delete = []
+    backup_file = None
+    try:
+        chapters = parse_cue_file(cue_full)
+        if not chapters:
+            print(f"No chapters found in {cue_full}")
+            return files_to_delete
+        backup_file = embed_chapters(mp3_full, chapters)
+    except Exception as e:
+        print(f"Error processing {mp3_full} and {cue_full}: {e}")
+        return files_to_delete
+    # Only add files that exist
+    if backup_file and os.path.exists(backup_file):
+        files_to_delete.append(backup_file)
+    if os.path.exists(cue_full):
+        files_to_delete.append(cue_full)
+    return files_to_delete
+
+
 # New function for folder processing with deletion preview
-def process_folder_with_deletion(pairs):
+def process_folder_with_deletion(pairs, progress=None):
+    """
+    Processes all pairs in a process pool and collects the files to delete.
+    If given, progress(done, total) is called after each finished pair.
+    """
     files_to_delete = []
-    for mp3_full, cue_full in pairs:
-        print(f"Processing:\n  MP3: {mp3_full}\n  CUE: {cue_full}")
-        backup_file = None
+    if not pairs:
+        return files_to_delete
+    max_workers = min(os.cpu_count() or 1, len(pairs))
+    if sys.platform == "win32":
+        max_workers = min(max_workers, 61)  # ProcessPoolExecutor limit on Windows.
+    with ProcessPoolExecutor(max_workers=max_workers) as ex:
+        futures = [ex.submit(embed_pair, mp3_full, cue_full) for mp3_full, cue_full in pairs]
+        if progress:
+            for done, _ in enumerate(as_completed(futures), 1):
+                progress(done, len(pairs))
+    # Collect in pair order; a failed worker (e.g. BrokenProcessPool) only
+    # loses its own pair.
+    for (mp3_full, cue_full), future in zip(pairs, futures):
         try:
-            chapters = parse_cue_file(cue_full)
-            if not chapters:
-                print(f"No chapters found in {cue_full}")
-                continue
-            backup_file = embed_chapters(mp3_full, chapters)
+            files_to_delete.extend(future.result())
         except Exception as e:
             print(f"Error processing {mp3_full} and {cue_full}: {e}")
-            continue
-        # Only add files that exist
-        if backup_file and os.path.exists(backup_file):
-            files_to_delete.append(backup_file)
-        if os.path.exists(cue_full):
-            files_to_delete.append(cue_full)
     return files_to_delete
 
 